@@ -4,13 +4,17 @@ Authentication module for getting Graph and Substrate tokens.
 This module provides authentication for Microsoft services using MSAL and Azure CLI.
 """
 
+import base64
+import hashlib
+import json
 import logging
 import sys
+import threading
 import time
 import msal
-import jwt
 import ctypes
 from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from azure.identity import AzureCliCredential
 
@@ -26,6 +30,55 @@ _mcp_client_id = '9ce97a32-d9ab-4ab2-aadc-f49b39b94e11'
 # Sample LLM API client id
 _sample_client_id = '68df66a4-cad9-4bfd-872b-c6ddde00d6b2'  # Sample LLM API client id
 _substrate_llm_scopes = ["https://substrate.office.com/llmapi/LLMAPI.dev"]
+# Treat tokens as stale this many seconds before they actually expire
+_expiry_skew = 60
+# Start a background refresh when a cached token expires within this many seconds
+_refresh_ahead = 300
+# Wait at least this many seconds between background refresh attempts for the same token
+_refresh_retry_cooldown = 60
+_azure_openai_scope = ["https://cognitiveservices.azure.com/.default"]
+# Decoded payloads are cached for at most this many seconds, and never past the token's own exp
+_decode_cache_ttl = 60
+_decode_cache_size = 1024
+
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+
+_decode_cache: dict[bytes, tuple[dict, float]] = {}     # sha256(token)[:16] -> (payload, expires_at)
+_decode_cache_lock = threading.Lock()
+
+
+def _decode_unverified(token: str) -> dict:
+    """Decode the JWT payload without verifying the signature.
+    Results are cached for a short while, keyed by a token digest so the cache doesn't hold the bearer strings."""
+    key = hashlib.sha256(token.encode()).digest()[:16]
+    now = time.time()
+    with _decode_cache_lock:
+        entry = _decode_cache.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+    payload_b64 = token.split(".", 2)[1]
+    payload_b64 += "=" * (-len(payload_b64) % 4)
+    payload = json.loads(base64.urlsafe_b64decode(payload_b64))
+    if not isinstance(payload, dict):
+        raise ValueError(f"JWT payload is not a JSON object: {type(payload).__name__}")
+
+    expires_at = min(now + _decode_cache_ttl, payload.get('exp', now))
+    if expires_at > now:
+        with _decode_cache_lock:
+            if len(_decode_cache) >= _decode_cache_size:
+                for k in [k for k, (_, exp) in _decode_cache.items() if exp <= now]:
+                    del _decode_cache[k]
+                if len(_decode_cache) >= _decode_cache_size:
+                    del _decode_cache[next(iter(_decode_cache))]   # evict the oldest entry
+            _decode_cache[key] = (payload, expires_at)
+    return payload
 
 
 class AuthProvider(ABC):
@@ -99,154 +152,161 @@ class DefaultAuthProvider(AuthProvider):
             enable_broker_on_windows=True,
         )
 
-        self._tokens = {}
-        
-        # Setup logging
-        self.logger = logging.getLogger(__name__)
-        if not self.logger.handlers:
-            handler = logging.StreamHandler()
-            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
-            self.logger.setLevel(logging.INFO)
+        # reuse one credential so its internal caches survive across refreshes
+        self._azure_cli_credential = AzureCliCredential()
+
+        # token name -> (msal app, scopes). app None means the token comes from Azure CLI
+        self._token_sources: dict[str, tuple[msal.PublicClientApplication | None, list[str]]] = {
+            "azure": (None, _azure_openai_scope),
+            "substrate": (self._app, _scope),
+            "substrate_llm": (self._sample_llm_app, _substrate_llm_scopes),
+            "graph": (self._mcp_app, _graph_scope),
+        }
+        self._tokens: dict[str, tuple[str, float]] = {}     # name -> (token, exp)
+        self._refresh_tasks: dict[str, Future] = {}
+        self._last_refresh_attempt: dict[str, float] = {}   # name -> time of last background submit
+        # one lock per token, so concurrent callers don't fetch the same token twice
+        self._locks = {name: threading.RLock() for name in self._token_sources}
+        # interactive prompts open a browser / broker window, never show more than one at a time
+        self._interactive_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="token_refresh")
+    
+    def ensure_all_tokens(self) -> None:
+        """
+        Refresh all tokens concurrently, so the network round trips overlap on a cold cache
+        """
+        getters = [self.get_azure_openai_token, self.get_graph_token, self.get_substrate_token, self.get_substrate_llm_token]
+        with ThreadPoolExecutor(max_workers=len(getters)) as executor:
+            futures = [executor.submit(getter) for getter in getters]
+            for future in futures:
+                future.result()
     
     def _set_token(self, name: str, token: str) -> None:
-        self._tokens[name] = token
+        # decode once on store, so freshness checks are a plain float compare
+        exp = _decode_unverified(token)['exp']
+        self._tokens[name] = (token, exp)
+
+    def cached_token(self, name: str, min_ttl: float = _refresh_ahead) -> str | None:
+        """Return the cached token if it stays valid for at least min_ttl more seconds, else None.
+        Never acquires or refreshes anything, so it is cheap enough to call on every request."""
+        entry = self._tokens.get(name, None)
+        if entry is not None and entry[1] > time.time() + min_ttl:
+            return entry[0]
+        return None
 
     def _get_token(self, name: str) -> str | None:
-        return self._tokens.get(name, None)
+        entry = self._tokens.get(name, None)
+        return entry[0] if entry else None
 
-    def _is_fresh(self, token: str | None) -> bool:
-        if token is None:
-            self.logger.info("Token is None")
-            return False
+    def _is_fresh_name(self, name: str) -> bool:
+        entry = self._tokens.get(name, None)
+        return entry is not None and entry[1] > time.time() + _expiry_skew
 
-        if token is not None:
-            decoded_token = jwt.decode(token, options={"verify_signature": False})
-            if decoded_token['exp'] < time.time():
-                self.logger.info(f"Token expired at {decoded_token['exp']}, current time is {time.time()}")
-                return False
-            
+    def _check_fresh(self, name: str) -> bool:
+        """
+        Return True if the cached token can still be served.
+        When the token is about to expire, a silent refresh is submitted to the executor while the old token keeps
+        being served. An in-flight refresh is only waited on once the token has expired. A refresh that failed or
+        did not extend exp is retried at most once per _refresh_retry_cooldown.
+        """
+        future = self._refresh_tasks.get(name)
+        if future is not None and (future.done() or not self._is_fresh_name(name)):
+            with self._locks[name]:
+                future = self._refresh_tasks.pop(name, None)
+                if future is not None:
+                    try:
+                        token = future.result()
+                        if token:
+                            self._set_token(name, token)
+                    except Exception as e:
+                        logger.warning(f"Background refresh of {name} token failed: {e}")
+
+        entry = self._tokens.get(name, None)   # read once, clear_cache() may drop it concurrently
+        now = time.time()
+        if entry is None or entry[1] <= now + _expiry_skew:
+            return False
+        if name not in self._refresh_tasks \
+                and entry[1] - now < _refresh_ahead \
+                and now - self._last_refresh_attempt.get(name, 0.0) >= _refresh_retry_cooldown:
+            with self._locks[name]:
+                if name not in self._refresh_tasks \
+                        and now - self._last_refresh_attempt.get(name, 0.0) >= _refresh_retry_cooldown:
+                    logger.info(f"Token {name} expires soon, refreshing in background")
+                    self._last_refresh_attempt[name] = now
+                    self._refresh_tasks[name] = self._executor.submit(self._acquire_silent, name)
         return True
 
-    def get_azure_openai_token(self) -> str:
-        self.refresh_azure_openai_token()
-        return self._get_token("azure")
+    def _acquire_silent(self, name: str) -> str | None:
+        """ Acquire a token without any UI (MSAL cache / refresh token, or Azure CLI). Returns None if not possible."""
+        app, scopes = self._token_sources[name]
+        if app is None:
+            return self._azure_cli_credential.get_token(*scopes).token
+        accounts = app.get_accounts()
+        if not accounts:
+            return None
+        result = app.acquire_token_silent(scopes, account=accounts[0])
+        if result and 'access_token' in result:
+            return result['access_token']
+        return None
+
     def get_azure_openai_token(self) -> str:
         self.refresh_azure_openai_token()
         return self._get_token("azure")
 
-    def get_substrate_token(self) -> str:
-        self.refresh_substrate_token()
-        return self._get_token("substrate")
     def get_substrate_token(self) -> str:
         self.refresh_substrate_token()
         return self._get_token("substrate")
 
-    def get_substrate_llm_token(self) -> str:
-        self.refresh_substrate_llm_token()
-        return self._get_token("substrate_llm")
     def get_substrate_llm_token(self) -> str:
         self.refresh_substrate_llm_token()
         return self._get_token("substrate_llm")
 
-    def get_graph_token(self) -> str:
-        self.refresh_graph_token()
-        return self._get_token("graph")   
     def get_graph_token(self) -> str:
         self.refresh_graph_token()
         return self._get_token("graph")   
 
-    def refresh_substrate_token(self) -> None:
-        current_token = self._get_token("substrate")
-        if self._is_fresh(current_token):
+    def _refresh(self, name: str) -> None:
+        if self._check_fresh(name):
             return
-        self.logger.info("Refreshing substrate token")
-        # Acquire a token interactively
-        result = self._app.acquire_token_interactive(scopes=_scope, parent_window_handle=self._get_console_window())
-        if 'access_token' in result:
-            self._set_token("substrate", result['access_token'])
-        else:
-            raise Exception("Failed to acquire token")
+        with self._locks[name]:
+            # another thread may have refreshed the token while we waited for the lock
+            if self._check_fresh(name):
+                return
+
+            logger.info(f"Refreshing {name} token")
+            # Try silent acquisition first, only fall back to the interactive prompt if that fails
+            token = self._acquire_silent(name)
+            if token is None:
+                app, scopes = self._token_sources[name]
+                with self._interactive_lock:
+                    result = app.acquire_token_interactive(scopes=scopes, parent_window_handle=self._get_console_window())
+                if 'access_token' not in result:
+                    raise Exception("Failed to acquire token")
+                token = result['access_token']
+            self._set_token(name, token)
+
     def refresh_substrate_token(self) -> None:
-        current_token = self._get_token("substrate")
-        if self._is_fresh(current_token):
-            return
-                
-        self.logger.info("Refreshing substrate token")
-        # Acquire a token interactively
-        result = self._app.acquire_token_interactive(scopes=_scope, parent_window_handle=self._get_console_window())
-        if 'access_token' in result:
-            self._set_token("substrate", result['access_token'])
-        else:
-            raise Exception("Failed to acquire token")
+        self._refresh("substrate")
 
     def refresh_substrate_llm_token(self) -> None:
-        current_token = self._get_token("substrate_llm")
-        if self._is_fresh(current_token):
-            return
-        self.logger.info("Refreshing substrate llm token")
-        # Acquire a token interactively
-        result = self._sample_llm_app.acquire_token_interactive(scopes=_substrate_llm_scopes, parent_window_handle=self._get_console_window())
-        if 'access_token' in result:
-            self._set_token("substrate_llm", result['access_token'])
-        else:
-            raise Exception("Failed to acquire token")
-    def refresh_substrate_llm_token(self) -> None:
-        current_token = self._get_token("substrate_llm")
-        if self._is_fresh(current_token):
-            return
-                
-        self.logger.info("Refreshing substrate llm token")
-        # Acquire a token interactively
-        result = self._sample_llm_app.acquire_token_interactive(scopes=_substrate_llm_scopes, parent_window_handle=self._get_console_window())
-        if 'access_token' in result:
-            self._set_token("substrate_llm", result['access_token'])
-        else:
-            raise Exception("Failed to acquire token")
+        self._refresh("substrate_llm")
 
     def refresh_azure_openai_token(self) -> None:
-        current_token = self._get_token("azure")
-        if self._is_fresh(current_token):
-            return
-        self.logger.info("Refreshing oai token")
-        credential = AzureCliCredential()
-        current_token = credential.get_token("https://cognitiveservices.azure.com/.default").token
-        self._set_token("azure", current_token)
-    def refresh_azure_openai_token(self) -> None:
-        current_token = self._get_token("azure")
-        if self._is_fresh(current_token):
-            return
-        
-        self.logger.info("Refreshing oai token")
-        credential = AzureCliCredential()
-        current_token = credential.get_token("https://cognitiveservices.azure.com/.default").token
-        self._set_token("azure", current_token)
+        self._refresh("azure")
 
     def refresh_graph_token(self) -> None:
-        current_token = self._get_token("graph")
-        if self._is_fresh(current_token):
-            return
-        self.logger.info("Refreshing graph token")
-        # Acquire a token interactively
-        result = self._mcp_app.acquire_token_interactive(scopes=_graph_scope, parent_window_handle=self._get_console_window())
-        if 'access_token' in result:
-            self._set_token('graph', result['access_token'])
-        else:
-            raise Exception("Failed to acquire token")
-    def refresh_graph_token(self) -> None:
-        current_token = self._get_token("graph")
-        if self._is_fresh(current_token):
-            return
-
-        self.logger.info("Refreshing graph token")
-        # Acquire a token interactively
-        result = self._mcp_app.acquire_token_interactive(scopes=_graph_scope, parent_window_handle=self._get_console_window())
+        self._refresh("graph")
 
-        if 'access_token' in result:
-            self._set_token('graph', result['access_token'])
-        else:
-            raise Exception("Failed to acquire token")
+    def clear_cache(self):
+        """Clear all cached tokens. Pending background refreshes are dropped so they can't reinstall a token."""
+        for name, lock in self._locks.items():
+            with lock:
+                future = self._refresh_tasks.pop(name, None)
+                if future is not None:
+                    future.cancel()
+                self._last_refresh_attempt.pop(name, None)
+                self._tokens.pop(name, None)
+        logger.info("Cleared token cache")
 
     def _get_console_window(self) -> None:
         """
@@ -254,69 +314,33 @@ class DefaultAuthProvider(AuthProvider):
         This is used to center the interactive login window.
         """
         if sys.platform != "win32":
-            self.logger.warning("Console window handle is only available on Windows.\nPlease consider using InputAuth if auth failed.")
+            logger.warning("Console window handle is only available on Windows.\nPlease consider using InputAuth if auth failed.")
             return None
     
         try:
             return ctypes.windll.kernel32.GetConsoleWindow()
         except (AttributeError, OSError) as e:
-            self.logger.warning(f"Could not get console window handle: {e}")
+            logger.warning(f"Could not get console window handle: {e}")
             return None
 
 def get_shard_id(token):
     """Get shard ID from token."""
-    decoded_token = jwt.decode(token, options={"verify_signature": False})
+    decoded_token = _decode_unverified(token)
     return "OID:" + decoded_token['oid'] + "@" + decoded_token['tid']
 
 
 def get_tenant_id(token):
     """Get tenant ID from token."""
-    decoded_token = jwt.decode(token, options={"verify_signature": False})
+    decoded_token = _decode_unverified(token)
     return decoded_token['tid']
  
 
 def get_user_id(token):
     """Get user ID from token."""
-    decoded_token = jwt.decode(token, options={"verify_signature": False})
+    decoded_token = _decode_unverified(token)
     return decoded_token['oid']
 
 
-# Simple wrapper class for easy usage
-class SimpleAuth:
-    """Simple authentication class for getting Microsoft service tokens."""
-    
-    def __init__(self):
-        self.auth_provider = DefaultAuthProvider()
-        self.logger = logging.getLogger(__name__)
-        if not self.logger.handlers:
-            handler = logging.StreamHandler()
-            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
-            self.logger.setLevel(logging.INFO)
-    
-    def get_graph_token(self) -> str:
-        """Get a token for Microsoft Graph API."""
-        return self.auth_provider.get_graph_token()
-    
-    def get_substrate_token(self) -> str:
-        """Get a token for Substrate service."""
-        return self.auth_provider.get_substrate_token()
-    
-    def get_azure_openai_token(self) -> str:
-        """Get a token for Azure OpenAI service."""
-        return self.auth_provider.get_azure_openai_token()
-    
-    def get_substrate_llm_token(self) -> str:
-        """Get a token for Substrate LLM service."""
-        return self.auth_provider.get_substrate_llm_token()
-    
-    def clear_cache(self):
-        """Clear all cached tokens."""
-        self.auth_provider._tokens.clear()
-        self.logger.info("Cleared token cache")
-        
-
 class InputAuth(AuthProvider):
     """
     Input-based authentication provider for testing purposes.
@@ -324,42 +348,37 @@ class InputAuth(AuthProvider):
     """
     
     def __init__(self) -> None:
-        self.logger = logging.getLogger(__name__)
-        if not self.logger.handlers:
-            handler = logging.StreamHandler()
-            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
-            self.logger.setLevel(logging.INFO)
         self.substrate_token = None
         self.graph_token = None
         self.azure_openai_token = None
         self.substrate_llm_token = None
+        # exp of each token, decoded once when the token is entered
+        self.substrate_token_exp = 0.0
+        self.graph_token_exp = 0.0
+        self.azure_openai_token_exp = 0.0
+        self.substrate_llm_token_exp = 0.0
 
     def get_azure_openai_token(self) -> str:
         # There is non good way to get Azure OpenAI token without user input
-        raise NotImplementedError("Azure OpenAI token not found a good way to get it, please try to use SimpleAuth or DefaultAuthProvider")
+        raise NotImplementedError("Azure OpenAI token not found a good way to get it, please try to use DefaultAuthProvider")
 
     def get_substrate_token(self) -> str:
-        if self.substrate_token and self._valid(self.substrate_token):
+        if self.substrate_token and self._valid("substrate_token"):
             return self.substrate_token
-        self.logger.info("Substrate token is not set or invalid, prompting for input.")
-        self.substrate_token = input("Enter Substrate token: ")
-        return self.substrate_token
+        logger.info("Substrate token is not set or invalid, prompting for input.")
+        return self._input_token("substrate_token", "Enter Substrate token: ")
 
     def get_substrate_llm_token(self) -> str:
-        if self.substrate_llm_token and self._valid(self.substrate_llm_token):
+        if self.substrate_llm_token and self._valid("substrate_llm_token"):
             return self.substrate_llm_token
-        self.logger.info("Substrate LLM token is not set or invalid, prompting for input.")
-        self.substrate_llm_token = input("Enter Substrate LLM token: ")
-        return self.substrate_llm_token
+        logger.info("Substrate LLM token is not set or invalid, prompting for input.")
+        return self._input_token("substrate_llm_token", "Enter Substrate LLM token: ")
 
     def get_graph_token(self) -> str:
-        if self.graph_token and self._valid(self.graph_token):
+        if self.graph_token and self._valid("graph_token"):
             return self.graph_token
             
-        self.graph_token = input("Enter Microsoft Graph token: ")
-        return self.graph_token
+        return self._input_token("graph_token", "Enter Microsoft Graph token: ")
 
     def refresh_azure_openai_token(self) -> None:
         pass
@@ -373,40 +392,61 @@ class InputAuth(AuthProvider):
     def refresh_graph_token(self) -> None:
         pass
 
-    def _valid(self, token: str) -> bool:
-        if token is None:
-            self.logger.info("Token is None")
+    def _input_token(self, name: str, prompt: str) -> str:
+        token = input(prompt).strip()
+        try:
+            exp = _decode_unverified(token)['exp']
+        except (IndexError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{name}: not a JWT") from e
+        setattr(self, name, token)
+        setattr(self, name + "_exp", exp)
+        return token
+
+    def _valid(self, name: str) -> bool:
+        exp = getattr(self, name + "_exp")
+        if exp < time.time():
+            logger.info(f"Token expired at {exp}, current time is {time.time()}")
             return False
-
-        if token is not None:
-            decoded_token = jwt.decode(token, options={"verify_signature": False})
-            if decoded_token['exp'] < time.time():
-                self.logger.info(f"Token expired at {decoded_token['exp']}, current time is {time.time()}")
-                return False
-            
         return True
 
-auth = SimpleAuth()
+_auth: DefaultAuthProvider | None = None
+_auth_lock = threading.Lock()
+
+
+def _get_auth() -> DefaultAuthProvider:
+    """Return the shared DefaultAuthProvider, created on first use so importing this module doesn't set up MSAL."""
+    global _auth
+    if _auth is None:
+        with _auth_lock:
+            if _auth is None:
+                _auth = DefaultAuthProvider()
+    return _auth
+
 
 # Convenience functions for easy import
 def get_graph_token() -> str:
     """Get a Microsoft Graph token."""
-    return auth.get_graph_token()
+    return _get_auth().get_graph_token()
 
 
 def get_substrate_token() -> str:
     """Get a Substrate service token."""
-    return auth.get_substrate_token()
+    return _get_auth().get_substrate_token()
 
 
 def get_substrate_llm_token() -> str:
     """Get a Substrate LLM service token."""
-    return auth.get_substrate_llm_token()
+    return _get_auth().get_substrate_llm_token()
 
 
 def get_azure_openai_token() -> str:
     """Get an Azure OpenAI token."""
-    return auth.get_azure_openai_token()
+    return _get_auth().get_azure_openai_token()
+
+
+def get_cached_azure_openai_token() -> str | None:
+    """Get the cached Azure OpenAI token if it is far from expiry, without refreshing it."""
+    return _get_auth().cached_token("azure")
 
 
 if __name__ == "__main__":
@@ -1,4 +1,6 @@
-from .auth import get_azure_openai_token
+from functools import lru_cache
+
+from .auth import get_azure_openai_token, get_cached_azure_openai_token
 
 from langchain_openai.chat_models import AzureChatOpenAI
 
@@ -17,7 +19,7 @@ class AOAILLMClient:
   
         self.llm = AzureChatOpenAI(  
             azure_endpoint=f'{self._endpoint}/',  
-            azure_ad_token_provider=get_azure_openai_token,  # Use AzureCliCredential for Azure AD token fetching  
+            azure_ad_token_provider=self._token_provider,  # Use AzureCliCredential for Azure AD token fetching  
             openai_api_version=self._api_version,  
             deployment_name=self._deployment_name,  
             model_name=self._model_name,  
@@ -29,22 +31,40 @@ class AOAILLMClient:
             top_p=self._top_p,  
         )  
   
+    def _token_provider(self) -> str:
+        """Serve the cached Azure OpenAI token directly while it is far from expiry.
+        Only go through the full refresh path when the token needs (background) refreshing."""
+        return get_cached_azure_openai_token() or get_azure_openai_token()
+
     def send_request(self, system: str, user: str = None) -> str:  
         """Send a prompt (system + user or system only) to the Azure OpenAI chat endpoint."""  
-        messages = [{"role": "system", "content": system}]  
-        if user:  
-            messages.append({"role": "user", "content": user})  
+        messages = [{"role": "system", "content": system}, {"role": "user", "content": user}] if user \
+            else [{"role": "system", "content": system}]
         response = self.llm.invoke(messages)  
         return response.content
 
-# llm_client = AOAILLMClient(
-#     openai_account='calendarai-ds-sc',
-#     deployment_name='gpt-4o',
-#     model_name='gpt-4o',
-# )
-llm_client = AOAILLMClient(
-    openai_account='calendarai-ds-sc',
-    deployment_name='gpt-4.1',
-    model_name='gpt-4.1',
-)
-# llm_client.send_request("", "你是一个专业的日本麻将AI助手。")
\ No newline at end of file
+    def send_batch(self, system: str, users: list[str], max_concurrency: int = 8) -> list[str]:
+        """Send several user prompts sharing one system prompt in a single batched call.
+        Requests run concurrently (up to max_concurrency); results keep the input order."""
+        batch = [[{"role": "system", "content": system}, {"role": "user", "content": user}] for user in users]
+        responses = self.llm.batch(batch, config={"max_concurrency": max_concurrency})
+        return [response.content for response in responses]
+
+@lru_cache(maxsize=None)
+def get_llm_client() -> AOAILLMClient:
+    """Return the shared LLM client, constructed on first use so importing this module stays cheap."""
+    # return AOAILLMClient(
+    #     openai_account='calendarai-ds-sc',
+    #     deployment_name='gpt-4o',
+    #     model_name='gpt-4o',
+    # )
+    return AOAILLMClient(
+        openai_account='calendarai-ds-sc',
+        deployment_name='gpt-4.1',
+        model_name='gpt-4.1',
+    )
+
+
+if __name__ == "__main__":
+    # warm up auth + connection
+    print(get_llm_client().send_request("", "你是一个专业的日本麻将AI助手。"))
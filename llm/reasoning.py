@@ -1,6 +1,17 @@
+import hashlib
+import heapq
+import operator
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
+
+import numpy as np
+
 import common.mj_helper as mjh
 from common.log_helper import LOGGER
-from .openai_llm import llm_client
+from .openai_llm import get_llm_client
 
 
 # Natural language mapping for MJAI tiles (Chinese)
@@ -32,59 +43,175 @@ ACTION_NL = {
     'zimo': '自摸', 'hora': '和了', 'ryukyoku': '流局', 'nukidora': '抜きドラ', 'none': '过'
 }
 
-ACTION_NL_ADV = {
-    -3: '下家', -2: '对家', -1: '上家', 0: '自己', 1: '下家', 2: '对家', 3: '上家'  # for 4-player, wrap around
-}
+# relative seat names indexed by (target - actor) % seat_count
+ACTION_NL_ADV_4P = ('自己', '下家', '对家', '上家')
+ACTION_NL_ADV_3P = ('自己', '下家', '上家')
+
+_WINDS = ('东', '南', '西', '北')
+_BAKAZE_CN = dict(zip(mjh.MJAI_WINDS, _WINDS))     # 'E' -> '东', ...; plain dict.get beats str.translate here
+
+# Snapshot part of the prompt; filled with str.format_map in build_prompt
+_PROMPT_TEMPLATE = """你是一个专业的日本麻将高手，擅长分析和解读麻将游戏中的策略和技巧。
+请基于下列牌局快照和AI推荐，简明扼要地解释AI给出概率的原因。
+
+{header}
+分数: {score_text}
+
+场上弃牌（按位）:
+{seat_rows}
+
+我的手牌: {my_hand}
+我摸到: {tsumo}{shanten_line}
+
+AI 推荐:
+{reco}"""
+
+# bound lookups for the hot formatting paths. The table keys are identifier-like string literals,
+# which CPython already interns at compile time, so no sys.intern pass is needed.
+_TILE_GET = MJAI_TILE_2_NL.get
+_ACTION_GET = ACTION_NL.get
+# marker -> dora, red fives included ('5mr' indicates '6m')
+_DORA_GET = {**DORA_DORA_MARKERS, **{aka: DORA_DORA_MARKERS[aka[:2]] for aka in mjh.MJAI_AKA_DORAS}}.get
+
+# The public tables are read-only views. The bound lookups above keep the underlying dicts,
+# since a .get through MappingProxyType costs an extra call.
+MJAI_TILE_2_NL = MappingProxyType(MJAI_TILE_2_NL)
+DORA_DORA_MARKERS = MappingProxyType(DORA_DORA_MARKERS)
+ACTION_NL = MappingProxyType(ACTION_NL)
 
 
 def mjai_to_natural(tile: str) -> str:
     """Convert a single MJAI tile code to Chinese natural language.
     Falls back to the original string if unknown.
     """
-    return MJAI_TILE_2_NL.get(tile, tile)
+    return _TILE_GET(tile, tile)
+
+
+def _make_action_fmt(desc: str):
+    def fmt(tile) -> str:
+        if tile:
+            return f'{desc} {mjai_to_natural(tile)}'
+        return desc
+    return fmt
+
+
+def _fmt_dahai(tile) -> str:
+    # short form for dahai, e.g. 打八饼
+    if tile:
+        return f'打{mjai_to_natural(tile)}'
+    return '打'
+
+
+# discard label indexed by is_tsumogiri
+_DISC_LABELS = ('手切', '摸切')
+
+# (action type, tile) -> NL, specialized per action type at import
+_ACT_TUPLE_FMT = {typ: _make_action_fmt(desc) for typ, desc in ACTION_NL.items()}
+_ACT_TUPLE_FMT['dahai'] = _fmt_dahai
 
 
 def tile_list_to_nl(tiles, tile_types) -> str:
     if not tiles:
         return '无'
-    try:
-        return '、'.join(f"{tile_types[i]}{mjai_to_natural(t)}" for i, t in enumerate(tiles))
-    except Exception:
+    if not tile_types or len(tile_types) < len(tiles):
         return str(tiles)
+    # label + NL name per tile, both maps run in C
+    return '、'.join(map(operator.add, tile_types, map(_TILE_GET, tiles, tiles)))
 
 def tile_list_to_nl_single(tiles) -> str:
     if not tiles:
         return '无'
-    try:
-        return '、'.join(mjai_to_natural(t) for t in tiles)
-    except Exception:
-        return str(tiles)
+    # map(get, tiles, tiles) calls get(tile, tile) per tile without a Python-level loop
+    return '、'.join(map(_TILE_GET, tiles, tiles))
     
 def get_dora_from_markers(dora_markers) -> list:
     """Given a list of dora markers, return the corresponding dora tiles."""
     if not dora_markers:
         return []
-    dora_tiles = []
-    for marker in dora_markers:
-        dora = DORA_DORA_MARKERS.get(marker)
-        if dora:
-            dora_tiles.append(dora)
-    return dora_tiles
+    return [dora for dora in map(_DORA_GET, dora_markers) if dora is not None]
 
 def melds_to_nl(melds, melds_types) -> str:
     """Format melds (副露) into NL. Each meld can be a list of tile codes or a string.
     """
     if not melds:
         return '无'
+    get = _TILE_GET
     out = []
     for j, meld in enumerate(melds):
         if isinstance(meld, (list, tuple)):
-            out.append(f"[{melds_types[j]}: " + '、'.join(f"{mjai_to_natural(t)}" for t in meld) + ']')
+            label = melds_types[j] if j < len(melds_types) else ''
+            out.append(f"[{label}: {'、'.join(map(get, meld, meld))}]")
         else:
             out.append(str(meld))
     return '，'.join(out)
 
 
+# The meta decode below stays in numpy: the arrays are at most 46 long and results are memoized per
+# (q_values, mask_bits), so a JIT compiler would mostly add import/compile time to the packaged app.
+def _mask_indices(mask_bits) -> np.ndarray:
+    """Positions of the set bits in mask_bits, lowest bit first."""
+    mask_bits = operator.index(mask_bits)
+    raw = mask_bits.to_bytes(max(1, (mask_bits.bit_length() + 7) // 8), 'little')
+    return np.flatnonzero(np.unpackbits(np.frombuffer(raw, dtype=np.uint8), bitorder='little'))
+
+
+def _top2(values: np.ndarray) -> list:
+    """Indices of the two largest values, largest first; ties keep the lower index first.
+    Two argmax passes instead of a full sort."""
+    if values.size < 2:
+        return list(range(values.size))
+    first = int(np.argmax(values))
+    second = int(np.argmax(np.delete(values, first)))
+    return [first, second + (second >= first)]
+
+
+def _meta_top2(q_values, mask_bits, is_3p: bool) -> tuple:
+    """mjh.meta_to_options(...)[:2] in numpy: softmax over all q_values, gathered at the first 46
+    mask positions, top two by weight (ties keep mask order). Raises where meta_to_options would."""
+    mask_list = mjh.MJAI_MASK_LIST_3P if is_3p else mjh.MJAI_MASK_LIST
+    idx = _mask_indices(mask_bits)
+    idx = idx[idx < 46]
+    weights = mjh.softmax(q_values)
+    if weights.size < idx.size:
+        raise IndexError('fewer q_values than mask bits')
+    if idx.size and idx[-1] >= len(mask_list):
+        raise IndexError('mask bit outside the action list')
+    weights = weights[:idx.size]
+    top = _top2(weights)
+    return tuple((mask_list[i], weights[j]) for j, i in zip(top, idx[top].tolist()))
+
+
+def _parse_meta(q_values, mask_bits, is_3p: bool) -> tuple[list, str]:
+    """Decode q_values + mask_bits into the top two (tile, weight) options and a source note."""
+    # Same decoding as mjh.meta_to_options, vectorized; fallback to manual parsing if it fails
+    try:
+        return _meta_top2(q_values, mask_bits, is_3p), '来自 meta (q_values + mask_bits)'
+    except Exception:
+        # Fallback: manual parse using q_values and mask_bits
+        try:
+            mask_list = mjh.MJAI_MASK_LIST_3P if is_3p else mjh.MJAI_MASK_LIST
+            # q_values only hold entries for the set mask bits, in order
+            idx = _mask_indices(mask_bits)
+            sub_q = np.asarray(q_values, dtype=float)[:len(idx)]
+            # exp is monotonic: rank on the raw q_values and only normalize the top two
+            top = _top2(sub_q)
+            probs = []
+            if sub_q.size:
+                q_max = sub_q.max()
+                probs = (np.exp(sub_q[top] - q_max) / np.exp(sub_q - q_max).sum()).tolist()
+            # set bits without a q_value get weight 0
+            pad = list(range(sub_q.size, min(len(idx), sub_q.size + 2 - len(top))))
+            options = tuple((mask_list[i] if i < len(mask_list) else f'idx_{i}', p)
+                            for i, p in zip(idx[top + pad].tolist(), probs + [0.0] * len(pad)))
+            return options, '来自 meta (手动解析 q_values + mask_bits)'
+        except Exception as e2:
+            return (), f'解析 meta 出错: {e2}'
+
+
+# re-rendering the same turn reuses the decoded options
+_parse_meta_cached = lru_cache(maxsize=256)(_parse_meta)
+
+
 def parse_ai_recommendation(ai_reco: dict, is_3p: bool = False, top_k: int = 3):
     """Return up to two (action_nl, prob) pairs for the highest-probability options and a description string.
 
@@ -106,32 +233,13 @@ def parse_ai_recommendation(ai_reco: dict, is_3p: bool = False, top_k: int = 3):
         meta_source = ai_reco
 
     if meta_source and 'q_values' in meta_source and 'mask_bits' in meta_source:
-        # Try to use helper in mj_helper first, fallback to manual parsing if needed
+        q_values = meta_source.get('q_values', [])
+        mask_bits = meta_source.get('mask_bits', 0)
         try:
-            options = mjh.meta_to_options(meta_source, is_3p=is_3p)
-            info.append('来自 meta (q_values + mask_bits)')
-        except Exception as e:
-            # Fallback: manual parse using q_values and mask_bits
-            try:
-                mask_list = mjh.MJAI_MASK_LIST_3P if is_3p else mjh.MJAI_MASK_LIST
-                q_values = meta_source.get('q_values', [])
-                mask_bits = meta_source.get('mask_bits', 0)
-                mask = mjh.mask_bits_to_bool_list(mask_bits)
-                weight_values = mjh.softmax(q_values)
-                option_list = []
-                q_value_idx = 0
-                for i in range(len(mask)):
-                    if mask[i]:
-                        name = mask_list[i] if i < len(mask_list) else f'idx_{i}'
-                        w = float(weight_values[q_value_idx]) if q_value_idx < len(weight_values) else 0.0
-                        option_list.append((name, w))
-                        q_value_idx += 1
-                option_list = sorted(option_list, key=lambda x: x[1], reverse=True)
-                options = option_list
-                info.append('来自 meta (手动解析 q_values + mask_bits)')
-            except Exception as e2:
-                options = []
-                info.append(f'解析 meta 出错: {e2}')
+            options, meta_info = _parse_meta_cached(tuple(q_values), mask_bits, is_3p)
+        except TypeError:   # unhashable / non-iterable inputs, parse without the cache
+            options, meta_info = _parse_meta(q_values, mask_bits, is_3p)
+        info.append(meta_info)
 
     elif isinstance(ai_reco, dict) and 'options' in ai_reco and isinstance(ai_reco['options'], list):
         options = ai_reco['options']
@@ -146,7 +254,7 @@ def parse_ai_recommendation(ai_reco: dict, is_3p: bool = False, top_k: int = 3):
         # attempt to interpret as action->score mapping
         if isinstance(ai_reco, dict):
             try:
-                options = sorted(ai_reco.items(), key=lambda kv: kv[1], reverse=True)
+                options = heapq.nlargest(2, ai_reco.items(), key=operator.itemgetter(1))
                 info.append('从字典 (action->score) 解析')
             except Exception:
                 options = []
@@ -171,222 +279,284 @@ def action_to_nl(act) -> str:
 
     Special case: for dahai (discard) prefer the short form '打X' (e.g. 打八饼) to match user examples.
     """
+    return _ACT_DISPATCH.get(type(act), _act_from_other)(act)
+
+
+def _act_from_tuple(act) -> str:
+    fmt = _ACT_TUPLE_FMT.get(act[0]) if len(act) >= 2 and isinstance(act[0], str) else None
+    if fmt is not None:
+        return fmt(act[1])
+    # if looks like (tile, prob) from some APIs, return tile NL
+    if len(act) == 2 and isinstance(act[0], str) and isinstance(act[1], (float, int)):
+        return mjai_to_natural(act[0])
+    return ' '.join(str(a) for a in act)
+
+
+def _act_from_dict(act) -> str:
+    typ = act.get('type') or act.get('action')
+    pai = act.get('pai') or act.get('tile')
+    if typ:
+        fmt = _ACT_TUPLE_FMT.get(typ)
+        if fmt is not None:
+            return fmt(pai)
+        if pai:
+            return f'{typ} {mjai_to_natural(pai)}'
+        return typ
+    if pai:
+        return mjai_to_natural(pai)
+    return str(act)
+
+
+def _act_from_str(act) -> str:
+    desc = _ACTION_GET(act)
+    if desc is not None:
+        # short form for dahai string 'dahai'
+        if act == 'dahai':
+            return '打'
+        return desc
+    return mjai_to_natural(act)
+
+
+# strings and tuples are pure inputs, serve them from a cache
+_act_from_str_cached = lru_cache(maxsize=256)(_act_from_str)
+_act_from_tuple_cached = lru_cache(maxsize=256)(_act_from_tuple)
+
+
+def _act_from_seq(act) -> str:
+    act = tuple(act)
+    try:
+        return _act_from_tuple_cached(act)
+    except TypeError:   # unhashable element inside the tuple
+        return _act_from_tuple(act)
+
+
+def _act_from_other(act) -> str:
+    """None, subclasses of the dispatched types, and anything else."""
     if act is None:
         return '无'
-
-    # tuple/list forms
     if isinstance(act, (tuple, list)):
-        if len(act) >= 2 and isinstance(act[0], str) and act[0] in ACTION_NL:
-            typ = act[0]
-            tile = act[1] if len(act) > 1 else None
-            desc = ACTION_NL.get(typ, typ)
-            # short form for dahai
-            if typ == 'dahai':
-                if tile:
-                    return f'打{mjai_to_natural(tile)}'
-                return '打'
-            if tile:
-                return f'{desc} {mjai_to_natural(tile)}'
-            return desc
-        # if looks like (tile, prob) from some APIs, return tile NL
-        if len(act) == 2 and isinstance(act[0], str) and isinstance(act[1], (float, int)):
-            return mjai_to_natural(act[0])
-        return ' '.join(str(a) for a in act)
-
-    # dict form
+        return _act_from_seq(act)
     if isinstance(act, dict):
-        typ = act.get('type') or act.get('action')
-        pai = act.get('pai') or act.get('tile')
-        if typ:
-            desc = ACTION_NL.get(typ, typ)
-            if typ == 'dahai':
-                if pai:
-                    return f'打{mjai_to_natural(pai)}'
-                return '打'
-            if pai:
-                return f'{desc} {mjai_to_natural(pai)}'
-            return desc
-        if pai:
-            return mjai_to_natural(pai)
-        return str(act)
-
-    # string form
+        return _act_from_dict(act)
     if isinstance(act, str):
-        if act in ACTION_NL:
-            # short form for dahai string 'dahai'
-            if act == 'dahai':
-                return '打'
-            return ACTION_NL[act]
-        return mjai_to_natural(act)
-
+        return _act_from_str(act)
     return str(act)
 
-def disc_type_to_nl(discard_type) -> str:
-    """Convert discard type list (e.g. [True, False, ...]) to NL string indicating tsumogiri.
+
+_ACT_DISPATCH = {str: _act_from_str_cached, tuple: _act_from_seq, list: _act_from_seq, dict: _act_from_dict}
+
+
+def disc_type_to_nl(discard_type) -> list:
+    """Convert discard type list (e.g. [True, False, ...]) to a list of NL labels indicating tsumogiri.
     """
-    if not discard_type:
-        return ''
-    try:
-        parts = []
-        for idx, is_tsumogiri in enumerate(discard_type):
-            if is_tsumogiri:
-                parts.append(f'摸切')
-            else:
-                parts.append(f'手切')
-        return parts
-    except Exception:
-        return str(discard_type)
+    if not isinstance(discard_type, (list, tuple)):
+        return []
+    return [_DISC_LABELS[bool(is_tsumogiri)] for is_tsumogiri in discard_type]
     
-def melds_info_to_nl(melds_info) -> str:
-    """Convert melds info list (e.g. [('pon', 'E'), ...]) to NL string.
+def melds_info_to_nl(melds_info, seat_count: int = 4) -> list:
+    """Convert melds info list (e.g. [('pon', 0, 1), ...]) to a list of NL labels.
+    seat_count (3 or 4) decides how the relative seat of the target wraps around.
     """
-    if not melds_info:
+    if not isinstance(melds_info, (list, tuple)):
+        return []
+    rel_names = ACTION_NL_ADV_3P if seat_count == 3 else ACTION_NL_ADV_4P
+    parts = []
+    for info in melds_info:
+        if isinstance(info, (list, tuple)) and len(info) >= 1:
+            typ = info[0]
+            actor = info[1] if len(info) > 1 else None
+            target = info[2] if len(info) > 2 else None
+            desc = _ACTION_GET(typ)
+            if isinstance(actor, int) and isinstance(target, int) and target != actor:
+                adv = rel_names[(target - actor) % len(rel_names)]
+                parts.append(f'{desc}（来自{adv}）')
+            else:
+                parts.append(desc)
+        else:
+            parts.append(str(info))
+    return parts
+
+
+# Instructions for the LLM, sent as the system message so the provider can cache it across turns
+_INSTRUCTIONS = """核心原则​​：何切是风险与回报的动态权衡，需同步评估「手牌潜力」「当前局势」「对手信息」「风格偏好」，而非依赖单一标准。
+                 
+你可以参考以下几个方面来思考为什么AI会推荐打掉这些牌：
+1. 牌效与进张：考虑打掉的牌是否提升了手牌的整体效率和进张机会，是否会降低向听数。
+2. 役种与打点：评估打掉的牌是否有助于达成特定的役种，是否影响最终的打点。
+3. 安全性与防守：分析打掉的牌是否是安全牌，是否有助于降低放铳风险。注意：这个考量往往在对手立直或局势紧张时更为重要，在早巡一般不会考虑。
+4. 防守与对攻：如果对手已经立直，评估打掉的牌是否安全，是否可能被对手和了。需要考虑自己牌的价值。如果自己的牌很大且已经听牌，可能会选择冒险打出一些不太安全的牌以追求和牌；如果自己的牌较小且未听牌，可能会更倾向于打出安全牌以防止放铳。
+5. 听牌质量：如果打掉的牌能让手牌进入听牌状态，评估听牌的质量（如听牌数、役种、打点）。
+6. 局势与对手：结合当前的局势（如分数、剩余牌数、对手状态）来判断打掉的牌是否符合整体战略。如果处于领先位置，可能更倾向于保守打法；如果落后，可能需要冒险追求高打点。
+7. 立直与默听：如果听牌且无役，且局势需要打点，一般会选择立直。但如果听的太差（如山里最多只有一枚），可以等待改良。如果听牌有役，且局势允许，可以选择默听以追求更高和率。
+8. 和牌与见逃：如果已经听牌，如果是All Last，需要评估是否荣和牌或自摸后能逆转顺位或避四。如果不是All Last，一般会选择和牌以结束局面，除非确定可以拿到更多的流局听牌罚符。
+9. 在局势紧张（如有人立直）之前，大部分时候会优先考虑提升手牌效率和进张机会，而不是过度关注安全性。搭子质量从形状上讲往往可以按照下面的优先级来衡量：孤张 < 边张 < 坎张 < 两面。 在搭子不齐时，应留下尽可能多的搭子，并留下更有可能形成搭子的牌，如手中有孤张的1p4p，则可以打掉1p，因为不会损失2p3p的进张。在搭子齐了之后，从进张效率讲，有一些牌也是无用的：如356s中的3s，因为打掉3s不会损失4s的进张。而搭子的和牌概率也非常受场况的影响：如手中有45m的搭子，但场上36m已经打出7枚，则这个搭子最多还能在山里摸到一枚形成面子，那么这个搭子质量很差了；相对应地，如果场上已经打出了4张4s，而一枚3s也没有打出，则手中的12s搭子质量就很好。
+
+对于AI给出的若干个推荐打掉的牌或做出的鸣/荣/自摸决定，请你：
+对于每个动作，给出一个词概括AI为什么决定这样做。然后用一句简短的话具体分析打出/鸣/和这张牌的好处和坏处。
+请用类似于以下的格式输出：
+牌：原因；具体分析。
+                 
+其中牌为AI推荐打出的牌，原因是个词，具体分析为一句简短的话具体分析打出这张牌的好处和坏处。
+如：
+九万：牌效；早巡九万孤张且进张差，打出可提升整体牌效。
+碰：速攻；碰牌加速和牌进程，由于处于领先位置，所以可以快速过庄。
+"""
+
+
+_GAME_INFO_KEYS = ('bakaze', 'kyoku', 'honba', 'kyotaku', 'oya', 'dora_marker', 'dora', 'scores',
+                   'my_tehai', 'tehai', 'my_tsumohai', 'tsumohai', 'player_reached', 'player_reach',
+                   'self_seat', 'my_seat')
+_KYOKU_INFO_KEYS = ('scores', 'discarded', 'melded', 'discarded_type', 'melded_info')
+_MISSING = object()
+
+
+def _snapshot(obj, keys) -> dict:
+    """Copy the given fields of a dict or object into a plain dict. Missing fields are left out."""
+    if obj is None:
+        return {}
+    if isinstance(obj, dict):
+        return {k: obj[k] for k in keys if k in obj}
+    # instance attributes straight from __dict__, the rest (class defaults, properties) via getattr
+    attrs = getattr(obj, '__dict__', {})
+    snap = {}
+    for k in keys:
+        v = attrs[k] if k in attrs else getattr(obj, k, _MISSING)
+        if v is not _MISSING:
+            snap[k] = v
+    return snap
+
+
+def _per_seat(seq, seat_count: int) -> list:
+    """seq cut or padded with None to exactly seat_count entries."""
+    return list(seq[:seat_count]) + [None] * (seat_count - len(seq))
+
+
+@lru_cache(maxsize=16)
+def _seat_names(oya, seat_count: int) -> tuple:
+    """Seat labels, with each seat's wind relative to oya (dealer) when it is known."""
+    if oya is None:
+        return tuple(f'第{idx+1}位' for idx in range(seat_count))
+    return tuple(f'第{idx+1}位({_WINDS[(idx - oya) % 4]}家)' for idx in range(seat_count))
+
+
+@lru_cache(maxsize=16)
+def _seat_row_names(oya, seat_count: int, self_seat) -> tuple:
+    """Seat labels for the per-seat rows: _seat_names with '(我)' marking the player's own seat."""
+    return tuple(nm + '(我)' if idx == self_seat else nm
+                 for idx, nm in enumerate(_seat_names(oya, seat_count)))
+
+
+def _fmt_prob(p) -> str:
+    """Format a probability (fraction or percentage) for display after an action."""
+    if p is None:
         return ''
+    if isinstance(p, (int, float)):
+        return _fmt_prob_value(float(p))
     try:
-        parts = []
-        for info in melds_info:
-            if isinstance(info, (list, tuple)) and len(info) >= 1:
-                typ = info[0]
-                actor = info[1] if len(info) > 1 else None
-                target = info[2] if len(info) > 2 else None
-                desc = ACTION_NL.get(typ)
-                if target:
-                    parts.append(f'{desc}（来自{ACTION_NL_ADV.get(target - actor)}）')
-                else:
-                    parts.append(desc)
-            else:
-                parts.append(str(info))
-        return parts
-    except Exception:
-        return melds_info
+        pv = float(p)
+    except (TypeError, ValueError):
+        return f' ({p})'
+    return _fmt_prob_value(pv)
 
 
-def explain(game_info, kyoku_info, ai_recommendation: dict, is_3p: bool = False, top_k: int = 3) -> str:
+@lru_cache(maxsize=256)
+def _fmt_prob_value(pv: float) -> str:
+    # if value in [0,1] treat as fraction
+    if 0 <= pv <= 1:
+        return f' ({pv*100:.1f}%)'
+    # if plausible percentage already
+    if 1 < pv <= 100:
+        return f' ({pv:.1f}%)'
+    return f' ({pv})'
+
+
+def build_prompt(game_info, kyoku_info, ai_recommendation: dict, is_3p: bool = False, top_k: int = 3) -> str:
     """Generate a concise Chinese prompt to ask an LLM to explain an AI recommendation.
 
-    The prompt includes a short table summary, current discards/melds, the player's hand, the AI
-    recommendation (top items and meta), and a short instruction for the LLM to explain the
-    recommendation, list risks, propose alternatives, and give a final concise decision.
+    The prompt includes a short table summary, current discards/melds, the player's hand and the AI
+    recommendation (top items and meta). The instructions for the LLM (_INSTRUCTIONS) are sent
+    separately as the system message.
     """
 
-    def _get(obj, key, default=None):
-        if obj is None:
-            return default
-        if isinstance(obj, dict):
-            return obj.get(key, default)
-        return getattr(obj, key, default)
-
     # Basic table info
-    bakaze = _get(game_info, 'bakaze', '?')
-    kyoku = _get(game_info, 'kyoku', '?')
-    honba = _get(game_info, 'honba', 0)
-    kyotaku = _get(game_info, 'kyotaku', 0)
-    oya = _get(game_info, 'oya', None)
-    dora_marker = _get(game_info, 'dora_marker', _get(game_info, 'dora', ['?']))
+    gi = _snapshot(game_info, _GAME_INFO_KEYS)
+    ki = _snapshot(kyoku_info, _KYOKU_INFO_KEYS)
+
+    bakaze = gi.get('bakaze', '?')
+    kyoku = gi.get('kyoku', '?')
+    honba = gi.get('honba', 0)
+    kyotaku = gi.get('kyotaku', 0)
+    oya = gi.get('oya', None)
+    dora_marker = gi.get('dora_marker', gi.get('dora', ['?']))
     dora = get_dora_from_markers(dora_marker)
 
     # Scores (prefer game_info.scores, otherwise kyoku_info.scores)
-    scores = _get(game_info, 'scores', None)
+    scores = gi.get('scores', None)
     if scores is None:
-        scores = _get(kyoku_info, 'scores', None)
+        scores = ki.get('scores', None)
 
     # My hand / draw
-    my_tehai = _get(game_info, 'my_tehai', _get(game_info, 'tehai', None))
-    my_tsumohai = _get(game_info, 'my_tsumohai', _get(game_info, 'tsumohai', None))
+    my_tehai = gi.get('my_tehai', gi.get('tehai', None))
+    my_tsumohai = gi.get('my_tsumohai', gi.get('tsumohai', None))
 
     # reach flags
-    player_reached = _get(game_info, 'player_reached', _get(game_info, 'player_reach', None))
+    player_reached = gi.get('player_reached', gi.get('player_reach', None))
 
     # who is self (if provided)
-    self_seat = _get(game_info, 'self_seat', _get(game_info, 'my_seat', None))
+    self_seat = gi.get('self_seat', gi.get('my_seat', None))
 
     # kyoku detail: discarded & melded
-    discarded = _get(kyoku_info, 'discarded', None)
-    melded = _get(kyoku_info, 'melded', None)
-    discarded_type = _get(kyoku_info, 'discarded_type', None)  # if discard is tsumogiri
-    melded_info = _get(kyoku_info, 'melded_info', None)          # list of (type, target) for each meld
+    discarded = ki.get('discarded', None)
+    melded = ki.get('melded', None)
+    discarded_type = ki.get('discarded_type', None)  # if discard is tsumogiri
+    melded_info = ki.get('melded_info', None)          # list of (type, target) for each meld
+
+    # normalize per-seat sequences once; non-sequences become empty
+    score_list = scores if isinstance(scores, (list, tuple)) else ()
+    disc_list = discarded if isinstance(discarded, (list, tuple)) else ()
+    meld_list = melded if isinstance(melded, (list, tuple)) else ()
+    reached_list = player_reached if isinstance(player_reached, (list, tuple)) else ()
+    disc_type_list = discarded_type if isinstance(discarded_type, (list, tuple)) else ()
+    meld_info_list = melded_info if isinstance(melded_info, (list, tuple)) else ()
 
     # normalize seat count
-    seat_count = 3 if is_3p else 4
-    if scores and isinstance(scores, (list, tuple)):
-        seat_count = len(scores)
-    elif discarded and isinstance(discarded, (list, tuple)):
-        seat_count = len(discarded)
-    elif melded and isinstance(melded, (list, tuple)):
-        seat_count = len(melded)
+    seat_count = len(score_list) or len(disc_list) or len(meld_list) or (3 if is_3p else 4)
 
     # seat names relative to oya (dealer)
-    winds = ['东', '南', '西', '北']
-    seat_names = []
-    if oya is None:
-        seat_names = [f'第{idx+1}位' for idx in range(seat_count)]
-    else:
-        for idx in range(seat_count):
-            wind = winds[(idx - oya) % 4]
-            seat_names.append(f'第{idx+1}位({wind}家)')
+    seat_names = _seat_names(oya, seat_count)
+    row_names = _seat_row_names(oya, seat_count, self_seat)
 
-    bakaze_cn = {'E': '东', 'S': '南', 'W': '西', 'N': '北'}.get(bakaze, bakaze)
+    bakaze_cn = _BAKAZE_CN.get(bakaze, bakaze)
 
     # Short header
-    lines = []
-    lines.append('你是一个专业的日本麻将高手，擅长分析和解读麻将游戏中的策略和技巧。')
-    lines.append('请基于下列牌局快照和AI推荐，简明扼要地解释AI给出概率的原因。')
-    lines.append('')
-    header = f'场风: {bakaze_cn}{kyoku}局；本场: {honba}本；供托: {kyotaku}；庄家: {oya+1 if oya is not None else "未知"}位；宝牌: {mjai_to_natural(tile_list_to_nl_single(dora))}。'
+    header = f'场风: {bakaze_cn}{kyoku}局；本场: {honba}本；供托: {kyotaku}；庄家: {oya+1 if oya is not None else "未知"}位；宝牌: {tile_list_to_nl_single(dora)}。'
     if is_3p:
         header += '本局是三人麻将。'
-    lines.append(header)
 
     # Scores
-    if scores:
-        score_text = '；'.join(f"{seat_names[i] if i < len(seat_names) else '第'+str(i+1)+'位'} {int(s)}分" for i, s in enumerate(scores))
-        lines.append('分数: ' + score_text)
+    if score_list:
+        score_text = '；'.join(f"{nm} {int(s)}分" for nm, s in zip(seat_names, score_list))
     else:
-        lines.append('分数: 无')
-
-    # Discards & melds (concise)
-    lines.append('')
-    lines.append('场上弃牌（按位）:')
-    for i in range(seat_count):
-        nm = seat_names[i] if i < len(seat_names) else f'第{i+1}位'
-        nm = nm + '(我)' if i == self_seat else f'第{i+1}位'
-        dis_types = disc_type_to_nl(discarded_type[i])
-        melds_infos = melds_info_to_nl(melded_info[i])
-        print(melds_infos, melded[i])
-        disc_text = tile_list_to_nl(discarded[i], dis_types) if isinstance(discarded, (list, tuple)) and i < len(discarded) else '无'
-        md_text = melds_to_nl(melded[i], melds_infos) if isinstance(melded, (list, tuple)) and i < len(melded) else '无'
-        reach_flag = ''
-        try:
-            if isinstance(player_reached, (list, tuple)) and i < len(player_reached) and player_reached[i]:
-                reach_flag = '（立直）'
-        except Exception:
-            reach_flag = ''
-        lines.append(f'{nm}{reach_flag} 牌河: {disc_text}；副露: {md_text}')
-
-    # My hand
-    lines.append('')
-    lines.append('我的手牌: ' + (tile_list_to_nl_single(my_tehai) if my_tehai else '未知'))
-    lines.append('我摸到: ' + (mjai_to_natural(my_tsumohai) if my_tsumohai else '无'))
+        score_text = '无'
+
+    # Discards & melds (concise), one f-string per seat
+    rows = []
+    # every per-seat sequence padded to seat_count; a missing seat (None) renders as '无'
+    seats = zip(row_names, _per_seat(disc_list, seat_count), _per_seat(disc_type_list, seat_count),
+                _per_seat(meld_list, seat_count), _per_seat(meld_info_list, seat_count),
+                _per_seat(reached_list, seat_count))
+    for i, (nm, discs, disc_types, melds, meld_infos, reached) in enumerate(seats):
+        dis_types = disc_type_to_nl(disc_types)
+        melds_infos = melds_info_to_nl(meld_infos, 3 if is_3p else 4)
+        disc_text = tile_list_to_nl(discs, dis_types)
+        md_text = melds_to_nl(melds, melds_infos)
+        LOGGER.debug("seat %d melds_infos=%r melds=%s", i, melds_infos, md_text)
+        reach_flag = '（立直）' if reached else ''
+        rows.append(f'{nm}{reach_flag} 牌河: {disc_text}；副露: {md_text}')
 
     # AI recommendation parsing
     options, info_text = parse_ai_recommendation(ai_recommendation, is_3p=is_3p, top_k=top_k)
 
-    def _fmt_prob(p):
-        if p is None:
-            return ''
-        try:
-            pv = float(p)
-        except Exception:
-            return f' ({p})'
-        # if value in [0,1] treat as fraction
-        if 0 <= pv <= 1:
-            return f' ({pv*100:.1f}%)'
-        # if plausible percentage already
-        if 1 <= pv <= 100:
-            return f' ({pv:.1f}%)'
-        return f' ({pv})'
-
-
     # Meta summary (helpful for LLM reasoning)
     meta = None
     if isinstance(ai_recommendation, dict):
@@ -395,66 +565,151 @@ def explain(game_info, kyoku_info, ai_recommendation: dict, is_3p: bool = False,
         elif 'q_values' in ai_recommendation or 'mask_bits' in ai_recommendation:
             meta = ai_recommendation
 
-    if isinstance(meta, dict):
-        meta_lines = []
-        for k in ('shanten', 'at_furiten', 'is_greedy', 'eval_time_ns', 'batch_size'):
-            if k in meta:
-                meta_lines.append(f'{k}: {meta.get(k)}')
-                if k == 'shanten':
-                    lines.append(f'当前向听数: {meta.get(k)}')
-        # q_values top-3 by value (show indices + values) if available
-        qv = meta.get('q_values')
-        if isinstance(qv, (list, tuple)) and len(qv) > 0:
-            try:
-                top_q = sorted(list(enumerate(qv)), key=lambda t: t[1], reverse=True)[:3]
-                meta_lines.append('q_values(top3 indices->value): ' + ', '.join(f'{i}->{v:.4f}' for i, v in top_q))
-            except Exception:
-                pass
-        # if meta_lines:
-        #     lines.append('')
-        #     lines.append('AI meta: ' + '；'.join(meta_lines))
+    shanten_line = ''
+    if isinstance(meta, dict) and 'shanten' in meta:
+        shanten_line = f'\n当前向听数: {meta.get("shanten")}'
 
-    lines.append('')
-    lines.append(f'AI 推荐:')
     if options:
-        for idx, (act, prob) in enumerate(options[:top_k]):
-            lines.append(f'{idx+1}. {action_to_nl(act)}{_fmt_prob(prob)}')
+        reco = '\n'.join([f'{idx+1}. {action_to_nl(act)}{_fmt_prob(prob)}'
+                          for idx, (act, prob) in enumerate(options[:top_k])])
     else:
         # fallback: attempt to show top-level ai_recommendation fields
         if isinstance(ai_recommendation, dict) and 'type' in ai_recommendation:
             desc = action_to_nl(ai_recommendation)
             prob = ai_recommendation.get('prob')
-            lines.append('1. ' + desc + _fmt_prob(prob))
+            reco = '1. ' + desc + _fmt_prob(prob)
         else:
-            lines.append('无可解析的推荐')
-    # Instructions for the LLM (concise)
-    lines.append('')
-    lines.append("""核心原则​​：何切是风险与回报的动态权衡，需同步评估「手牌潜力」「当前局势」「对手信息」「风格偏好」，而非依赖单一标准。
-                 
-你可以参考以下几个方面来思考为什么AI会推荐打掉这些牌：
-1. 牌效与进张：考虑打掉的牌是否提升了手牌的整体效率和进张机会，是否会降低向听数。
-2. 役种与打点：评估打掉的牌是否有助于达成特定的役种，是否影响最终的打点。
-3. 安全性与防守：分析打掉的牌是否是安全牌，是否有助于降低放铳风险。注意：这个考量往往在对手立直或局势紧张时更为重要，在早巡一般不会考虑。
-4. 防守与对攻：如果对手已经立直，评估打掉的牌是否安全，是否可能被对手和了。需要考虑自己牌的价值。如果自己的牌很大且已经听牌，可能会选择冒险打出一些不太安全的牌以追求和牌；如果自己的牌较小且未听牌，可能会更倾向于打出安全牌以防止放铳。
-5. 听牌质量：如果打掉的牌能让手牌进入听牌状态，评估听牌的质量（如听牌数、役种、打点）。
-6. 局势与对手：结合当前的局势（如分数、剩余牌数、对手状态）来判断打掉的牌是否符合整体战略。如果处于领先位置，可能更倾向于保守打法；如果落后，可能需要冒险追求高打点。
-7. 立直与默听：如果听牌且无役，且局势需要打点，一般会选择立直。但如果听的太差（如山里最多只有一枚），可以等待改良。如果听牌有役，且局势允许，可以选择默听以追求更高和率。
-8. 和牌与见逃：如果已经听牌，如果是All Last，需要评估是否荣和牌或自摸后能逆转顺位或避四。如果不是All Last，一般会选择和牌以结束局面，除非确定可以拿到更多的流局听牌罚符。
-9. 在局势紧张（如有人立直）之前，大部分时候会优先考虑提升手牌效率和进张机会，而不是过度关注安全性。搭子质量从形状上讲往往可以按照下面的优先级来衡量：孤张 < 边张 < 坎张 < 两面。 在搭子不齐时，应留下尽可能多的搭子，并留下更有可能形成搭子的牌，如手中有孤张的1p4p，则可以打掉1p，因为不会损失2p3p的进张。在搭子齐了之后，从进张效率讲，有一些牌也是无用的：如356s中的3s，因为打掉3s不会损失4s的进张。而搭子的和牌概率也非常受场况的影响：如手中有45m的搭子，但场上36m已经打出7枚，则这个搭子最多还能在山里摸到一枚形成面子，那么这个搭子质量很差了；相对应地，如果场上已经打出了4张4s，而一枚3s也没有打出，则手中的12s搭子质量就很好。
+            reco = '无可解析的推荐'
+
+    return _PROMPT_TEMPLATE.format_map({
+        'header': header,
+        'score_text': score_text,
+        'seat_rows': '\n'.join(rows),
+        'my_hand': tile_list_to_nl_single(my_tehai) if my_tehai else '未知',
+        'tsumo': mjai_to_natural(my_tsumohai) if my_tsumohai else '无',
+        'shanten_line': shanten_line,
+        'reco': reco,
+    })
+
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='llm-explain')
+_EXPLAIN_CACHE_SIZE = 128
+_explain_cache: OrderedDict[bytes, str] = OrderedDict()
+_explain_cache_lock = threading.Lock()
+
+
+def _explain_key(prompt: str) -> bytes:
+    """Cache key: digest of the rendered prompt, the only input that reaches the LLM."""
+    return hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+
+
+def _cache_get(key: bytes) -> str | None:
+    with _explain_cache_lock:
+        explanation = _explain_cache.get(key)
+        if explanation is not None:
+            _explain_cache.move_to_end(key)
+        return explanation
+
+
+def _cache_put(key: bytes, explanation: str):
+    with _explain_cache_lock:
+        _explain_cache[key] = explanation
+        _explain_cache.move_to_end(key)
+        while len(_explain_cache) > _EXPLAIN_CACHE_SIZE:
+            _explain_cache.popitem(last=False)
+
+
+def _cache_clear():
+    """Drop all cached explanations (e.g. on game state transitions)."""
+    with _explain_cache_lock:
+        _explain_cache.clear()
 
-对于AI给出的若干个推荐打掉的牌或做出的鸣/荣/自摸决定，请你：
-对于每个动作，给出一个词概括AI为什么决定这样做。然后用一句简短的话具体分析打出/鸣/和这张牌的好处和坏处。
-请用类似于以下的格式输出：
-牌：原因；具体分析。
-                 
-其中牌为AI推荐打出的牌，原因是个词，具体分析为一句简短的话具体分析打出这张牌的好处和坏处。
-如：
-九万：牌效；早巡九万孤张且进张差，打出可提升整体牌效。
-碰：速攻；碰牌加速和牌进程，由于处于领先位置，所以可以快速过庄。
-""")
 
-    prompt = '\n'.join(lines)
+_NO_RECO_EXPLANATION = '无可解析的AI推荐，无需解释。'
+
+
+def _has_recommendation(ai_recommendation, is_3p: bool = False) -> bool:
+    """Whether the prompt would contain at least one recommended action."""
+    if isinstance(ai_recommendation, dict) and 'type' in ai_recommendation:
+        return True
+    options, _ = parse_ai_recommendation(ai_recommendation, is_3p=is_3p)
+    return bool(options)
+
+
+def _prepare_explain(game_info, kyoku_info, ai_recommendation, is_3p, top_k) -> tuple:
+    """Everything before the LLM call, done on the caller's thread while the inputs are stable.
+    Returns (explanation, None, None) when no call is needed, else (None, cache key, prompt)."""
+    if not _has_recommendation(ai_recommendation, is_3p):
+        LOGGER.info("无可解析的推荐，跳过解释: %s", ai_recommendation)
+        return _NO_RECO_EXPLANATION, None, None
+    prompt = build_prompt(game_info, kyoku_info, ai_recommendation, is_3p, top_k)
+    key = _explain_key(prompt)
+    explanation = _cache_get(key)
+    if explanation is not None:
+        LOGGER.info("使用缓存的解释: %s", explanation)
+        return explanation, None, None
     LOGGER.info("生成的提示语: %s", prompt)
-    explanation = llm_client.send_request("", prompt)
+    return None, key, prompt
+
+
+def _request_explanation(key: bytes, prompt: str) -> str:
+    explanation = get_llm_client().send_request(_INSTRUCTIONS, prompt)
     LOGGER.info("生成的解释: %s", explanation)
+    _cache_put(key, explanation)
     return explanation
+
+
+def explain(game_info, kyoku_info, ai_recommendation: dict, is_3p: bool = False, top_k: int = 3) -> str:
+    """Build the prompt for an AI recommendation and ask the LLM to explain it.
+    Explanations are cached by prompt, so re-explaining the same state skips the LLM call.
+    Without a parseable recommendation there is nothing to explain, and no LLM call is made."""
+    explanation, key, prompt = _prepare_explain(game_info, kyoku_info, ai_recommendation, is_3p, top_k)
+    if explanation is not None:
+        return explanation
+    return _request_explanation(key, prompt)
+
+
+explain.cache_clear = _cache_clear
+
+
+def explain_async(game_info, kyoku_info, ai_recommendation: dict, is_3p: bool = False,
+                  top_k: int = 3) -> Future:
+    """Like explain(), but the LLM call runs on a background thread. Returns a Future[str].
+    The prompt is built before returning, so the caller may mutate the inputs afterwards."""
+    explanation, key, prompt = _prepare_explain(game_info, kyoku_info, ai_recommendation, is_3p, top_k)
+    if explanation is not None:
+        done = Future()
+        done.set_result(explanation)
+        return done
+    return _EXECUTOR.submit(_request_explanation, key, prompt)
+
+
+_EXPLAIN_ARGS = ('game_info', 'kyoku_info', 'ai_recommendation', 'is_3p', 'top_k')
+
+
+def explain_batch(snapshots, is_3p: bool = False, max_workers: int = 8) -> list:
+    """Explain several recommendations with one batched LLM dispatch.
+
+    snapshots: iterable of (game_info, kyoku_info, ai_recommendation[, is_3p, top_k]) tuples or of
+    dicts with the keyword arguments of explain(). is_3p is the default for entries that don't set it.
+    All prompts share the instruction system message. Results keep the input order.
+    """
+    results = []
+    pending = {}    # cache key -> prompt, so identical snapshots are only sent once
+    for snap in snapshots:
+        kwargs = dict(snap) if isinstance(snap, dict) else dict(zip(_EXPLAIN_ARGS, snap))
+        kwargs.setdefault('is_3p', is_3p)
+        kwargs.setdefault('top_k', 3)
+        explanation, key, prompt = _prepare_explain(*(kwargs[arg] for arg in _EXPLAIN_ARGS))
+        if explanation is None:
+            pending.setdefault(key, prompt)
+        results.append((explanation, key))
+    answered = {}
+    if pending:
+        explanations = get_llm_client().send_batch(_INSTRUCTIONS, list(pending.values()),
+                                                   max_concurrency=max_workers)
+        for key, explanation in zip(pending, explanations):
+            LOGGER.info("生成的解释: %s", explanation)
+            _cache_put(key, explanation)
+            answered[key] = explanation
+    return [explanation if explanation is not None else answered[key] for explanation, key in results]